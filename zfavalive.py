@@ -1,17 +1,23 @@
 #!/usr/bin/env python3
 import sys
+import os
 import argparse
 import hashlib
 import io
+import mmap
 import asyncio
-import json
-from datetime import datetime, timedelta
+import multiprocessing
+import re
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from urllib.parse import urlparse
 from tld import get_tld
 from PIL import Image
+import numpy as np
 import aiohttp
+import orjson
 from tqdm import tqdm
-from tabulate import tabulate
 
 # Configuration
 DEFAULT_BATCH_SIZE = 20
@@ -19,118 +25,211 @@ DEFAULT_THREADS = 10
 MAX_URL_LENGTH = 2200
 BASE_URL = "https://favicon.yandex.net/favicon/"
 CACHE_TTL_HOURS = 24
+REQUEST_TIMEOUT = 30
+CACHE_MAX = 100_000
+QUANTIZED_SIZE = 16
+
+# SHA-256 prefix of Yandex's placeholder icon for domains without a favicon
+_NULL_DIGEST = bytes.fromhex('5f70bf18')
+
+# Cheap hostname shape check run before any TLD table lookup
+_DOMAIN_RE = re.compile(
+    r'^(?=.{1,253}$)(?:[a-z0-9_](?:[a-z0-9_-]{0,61}[a-z0-9])?\.)*(?:[a-z]{2,63}|xn--[a-z0-9-]{1,59})$',
+    re.I
+)
+
+def _decode_and_hash(img_data, domains, pending, show_white_hashes, quantize):
+    # Runs in a worker process: decode the sprite and fingerprint the tiles at the pending indices
+    with Image.open(io.BytesIO(img_data)) as img:
+        img = img.convert('RGBA')
+        w, h = img.size
+        # Tiles are stacked full-width rows, so each one is a contiguous range of the RGBA buffer
+        raw = memoryview(img.tobytes())
+
+    tile_height = h // len(domains)
+    stride = tile_height * w * 4
+    tiles = np.frombuffer(raw, dtype=np.uint8, count=len(domains) * stride).reshape(len(domains), stride)
+    white_tiles = _white_tile_mask(tiles)
+
+    results = []
+    for idx in pending:
+        if white_tiles[idx]:
+            display_hash = "NULL" if show_white_hashes else None
+        else:
+            start = idx * stride
+            display_hash = _process_tile(raw[start:start + stride], w, show_white_hashes, quantize)
+        results.append((domains[idx], display_hash))
+    return results
+
+def _process_tile(tile, width, show_white_hashes, quantize):
+    digest = hashlib.sha256(tile).digest()
+
+    if digest[:4] == _NULL_DIGEST:
+        return "NULL" if show_white_hashes else None
+
+    if quantize and len(tile):
+        return _quantized_hash(tile, width)
+
+    return digest[:4].hex()
+
+def _quantized_hash(tile, width):
+    # Nearest-neighbour downsample to 16x16 and keep the high nibble of each channel,
+    # so icons differing only by antialiasing or recompression collapse to one hash
+    pixels = np.frombuffer(tile, dtype=np.uint8).reshape(-1, width, 4)
+    rows = (np.arange(QUANTIZED_SIZE) * pixels.shape[0]) // QUANTIZED_SIZE
+    cols = (np.arange(QUANTIZED_SIZE) * width) // QUANTIZED_SIZE
+    nibbles = (pixels[rows][:, cols] >> 4).ravel()
+    packed = (nibbles[0::2] << 4) | nibbles[1::2]
+    return hashlib.sha256(packed.tobytes()).digest()[:4].hex()
+
+def _white_tile_mask(tiles):
+    if not tiles.shape[1]:
+        # Sprite shorter than its domain count: empty tiles carry no icon, treat them as white
+        return [True] * len(tiles)
+    # One reduction over all tiles at once: a tile is white when its minimum RGBA byte is 255
+    return (tiles.min(axis=1) == 255).tolist()
 
 class FaviconAnalyzer:
     def __init__(self):
         self.results = {}
-        self.seen_entries = set()
-        self.cache = {}
+        self.cache = OrderedDict()
         self.progress_bar = None
         self.session = None
+        # Sprite decoding and hashing are CPU-bound; keep them off the event loop.
+        # Workers start lazily, after tqdm and aiohttp have spawned threads, so never fork them
+        self.executor = ProcessPoolExecutor(
+            max_workers=os.cpu_count(),
+            mp_context=multiprocessing.get_context('spawn')
+        )
 
     def _init_cache(self):
-        self.cache = {}
+        self.cache = OrderedDict()
 
     def _is_cache_valid(self, entry):
-        return datetime.now() < entry['expires']
-
-    async def _get_session(self):
+        return time.monotonic() < entry['expires']
+
+    def _cache_get(self, domain):
+        entry = self.cache.get(domain)
+        if entry is None:
+            return None
+        if not self._is_cache_valid(entry):
+            del self.cache[domain]
+            return None
+        self.cache.move_to_end(domain)
+        return entry
+
+    def _cache_set(self, domain, display_hash):
+        self.cache[domain] = {
+            'hash': display_hash,
+            'expires': time.monotonic() + CACHE_TTL_HOURS * 3600
+        }
+        self.cache.move_to_end(domain)
+        while len(self.cache) > CACHE_MAX:
+            self.cache.popitem(last=False)
+
+    async def _get_session(self, threads):
         if not self.session:
-            self.session = aiohttp.ClientSession()
+            # The connector pool is the concurrency limit; requests beyond it queue for a free connection
+            connector = aiohttp.TCPConnector(
+                limit=threads,
+                limit_per_host=threads,
+                ttl_dns_cache=300,
+                enable_cleanup_closed=True
+            )
+            # Workers never outnumber pooled connections, so the total budget only covers the request itself
+            timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT, sock_read=REQUEST_TIMEOUT)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=timeout)
         return self.session
 
     async def _cleanup(self):
         if self.session and not self.session.closed:
             await self.session.close()
+        self.executor.shutdown()
 
     def is_valid_domain(self, domain):
+        if domain.isascii():
+            # Trailing-dot FQDNs (as printed by DNS tools) are accepted like the bare name
+            if not _DOMAIN_RE.match(domain.rstrip('.')):
+                return False
+            # fail_silently keeps exceptions out of the hot path
+            return bool(get_tld(domain, fix_protocol=True, fail_silently=True))
+
+        # IDN input: leave parsing to tld
         try:
             return bool(get_tld(domain, fix_protocol=True))
         except:
             return False
 
     def generate_batches(self, domains, batch_size):
-        batches = []
+        is_valid_domain = self.is_valid_domain
+        path_budget = MAX_URL_LENGTH - len(BASE_URL)
         current_batch = []
-        current_length = len(BASE_URL)
+        current_length = 0  # Path characters used so far, one separator per domain
 
         for domain in domains:  # Iteração única com filtro integrado
-            if not self.is_valid_domain(domain):
+            if not is_valid_domain(domain):
                 continue
 
-            domain_len = len(domain)
-            needed_length = current_length + domain_len + (1 if current_batch else 0)
+            needed = len(domain) + 1  # +1 para a barra
 
-            if needed_length > MAX_URL_LENGTH or len(current_batch) >= batch_size:
-                if current_batch:
-                    batches.append(current_batch)
+            if current_batch and (current_length + needed > path_budget or len(current_batch) >= batch_size):
+                yield current_batch
                 current_batch = []
-                current_length = len(BASE_URL)
+                current_length = 0
 
             current_batch.append(domain)
-            current_length += domain_len + 1  # +1 para a barra
+            current_length += needed
 
         if current_batch:
-            batches.append(current_batch)
-        return batches
+            yield current_batch
 
     async def process_batch(self, batch, args):
-        session = await self._get_session()
+        session = await self._get_session(args.threads)
         url = f"{BASE_URL}{'/'.join(batch)}"
         
         try:
             async with session.get(url) as response:
-                if response.status == 200:
-                    img_data = await response.read()
-                    await self._process_image_data(img_data, batch, args)
+                if response.status != 200:
+                    return
+                img_data = await response.read()
+            # Decode outside the response block so the connection is back in the pool first
+            await self._process_image_data(img_data, batch, args)
         except Exception as e:
             print(f"Error processing batch: {str(e)}")
 
     async def _process_image_data(self, img_data, domains, args):
-        with Image.open(io.BytesIO(img_data)) as img:
-            img = img.convert('RGBA')
-            w, h = img.size
-            tile_height = h // len(domains)
-
-            for idx, domain in enumerate(domains):
-                cached = self.cache.get(domain)
-                if cached and self._is_cache_valid(cached):
-                    display_hash = cached['hash']
-                else:
-                    y1 = idx * tile_height
-                    y2 = min(y1 + tile_height, h)
-                    tile = img.crop((0, y1, w, y2))
-                    display_hash = self._process_tile(domain, tile, args)
-                    self.cache[domain] = {
-                        'hash': display_hash,
-                        'expires': datetime.now() + timedelta(hours=CACHE_TTL_HOURS)
-                    }
-
-                if display_hash:
-                    self._update_results(domain, display_hash)
-
-    def _process_tile(self, domain, tile, args):
-        if self._is_white_square(tile):
-            return "NULL" if args.show_white_hashes else None
-
-        original_hash = hashlib.sha256(tile.tobytes()).hexdigest()[:8]
-
-        if original_hash.startswith("5f70bf18"):
-            return "NULL" if args.show_white_hashes else None
-
-        return original_hash
-
-    def _is_white_square(self, image):
-        if image.mode != 'RGBA':
-            image = image.convert('RGBA')
-        return all(r == g == b == 255 and a == 255 for (r, g, b, a) in image.getdata())
+        hashes = {}
+        pending = []
+        for idx, domain in enumerate(domains):
+            cached = self._cache_get(domain)
+            if cached:
+                hashes[domain] = cached['hash']
+            else:
+                pending.append(idx)
+
+        if pending:
+            loop = asyncio.get_running_loop()
+            computed = await loop.run_in_executor(
+                self.executor, _decode_and_hash,
+                img_data, tuple(domains), pending, args.show_white_hashes, args.quantize
+            )
+            for domain, display_hash in computed:
+                self._cache_set(domain, display_hash)
+                hashes[domain] = display_hash
+
+        for domain in domains:
+            if hashes[domain]:
+                self._update_results(domain, hashes[domain])
 
     def _update_results(self, domain, display_hash):
-        if not display_hash or (domain, display_hash) in self.seen_entries:
+        if not display_hash:
             return
 
-        self.seen_entries.add((domain, display_hash))
-        entry = self.results.setdefault(display_hash, {'count': 0, 'domains': []})
+        entry = self.results.setdefault(display_hash, {'count': 0, 'domains': [], '_seen': set()})
+        if domain in entry['_seen']:
+            return
+
+        entry['_seen'].add(domain)
         entry['count'] += 1
         entry['domains'].append(domain)
 
@@ -138,9 +237,10 @@ class FaviconAnalyzer:
         sorted_results = sorted(self.results.items(), key=lambda x: x[1]['count'], reverse=True)
         
         if output_format == 'json':
-            return json.dumps({
-                hash_val: data for hash_val, data in sorted_results
-            }, indent=2)
+            return orjson.dumps({
+                hash_val: {k: v for k, v in data.items() if not k.startswith('_')}
+                for hash_val, data in sorted_results
+            }, option=orjson.OPT_INDENT_2).decode()
         
         if output_format == 'csv':
             csv_lines = ["Hash,Count,Domains"]
@@ -152,9 +252,20 @@ class FaviconAnalyzer:
         table = []
         for hash_val, data in sorted_results:
             domains = self._truncate_domains(data['domains'], 2)
-            table.append([hash_val, data['count'], domains])
-        
-        return tabulate(table, headers=["Hash", "Count", "Domains"], tablefmt="github")
+            table.append((hash_val, str(data['count']), domains))
+
+        # GitHub-style table; headers get two columns of slack like tabulate's
+        hw = max([len("Hash") + 2] + [len(row[0]) for row in table])
+        cw = max([len("Count") + 2] + [len(row[1]) for row in table])
+        dw = max([len("Domains") + 2] + [len(row[2]) for row in table])
+
+        count_align = '>' if table else '<'  # tabulate only right-aligns numeric columns
+        lines = [
+            f"| {'Hash':<{hw}} | {'Count':{count_align}{cw}} | {'Domains':<{dw}} |",
+            f"|{'-' * (hw + 2)}|{'-' * (cw + 2)}|{'-' * (dw + 2)}|"
+        ]
+        lines.extend(f"| {h:<{hw}} | {c:>{cw}} | {d:<{dw}} |" for h, c, d in table)
+        return '\n'.join(lines)
 
     def _truncate_domains(self, domains, max_items):
         truncated = ', '.join(domains[:max_items])
@@ -171,6 +282,7 @@ async def main():
     parser.add_argument('-t', '--threads', type=int, default=DEFAULT_THREADS)
     parser.add_argument('-o', '--output-format', choices=['table', 'json', 'csv'], default='table')
     parser.add_argument('-dw', '--show-white-hashes', action='store_true')
+    parser.add_argument('-q', '--quantize', action='store_true')
     parser.add_argument('-h', '--help', action='help', help='Show help')
     
     args = parser.parse_args()
@@ -182,27 +294,37 @@ async def main():
             await analyzer.process_batch(args.url.split('/'), args)
         else:
             def domain_generator():
-                with open(args.wordlist) as f:
-                    for line in f:
-                        domain = line.strip()
-                        if analyzer.is_valid_domain(domain):
-                            yield domain
+                with open(args.wordlist, 'rb') as f:
+                    if not os.fstat(f.fileno()).st_size:
+                        return  # mmap rejects empty files
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                        start, size = 0, len(mm)
+                        while start < size:
+                            end = mm.find(b'\n', start)
+                            if end < 0:
+                                end = size
+                            yield mm[start:end].decode('utf-8', errors='replace').strip()
+                            start = end + 1
 
             domains = domain_generator()
             batches = analyzer.generate_batches(domains, args.batch)
 
-            semaphore = asyncio.Semaphore(args.threads)
-            
-            tasks = []
-            for batch in batches:
-                tasks.append(asyncio.create_task(
-                    process_batch_with_semaphore(semaphore, analyzer, batch, args)
-                ))
-
-            with tqdm(total=len(tasks), desc="Processing batches") as pbar:
-                for coro in asyncio.as_completed(tasks):
-                    await coro
-                    pbar.update(1)
+            queue = asyncio.Queue(maxsize=args.threads * 2)
+
+            # Batches are produced lazily, so the total isn't known up front
+            with tqdm(desc="Processing batches", unit="batch") as pbar:
+                workers = [
+                    asyncio.create_task(batch_worker(queue, analyzer, args, pbar))
+                    for _ in range(args.threads)
+                ]
+                try:
+                    for batch in batches:
+                        await queue.put(batch)
+                    await queue.join()
+                finally:
+                    for worker in workers:
+                        worker.cancel()
+                    await asyncio.gather(*workers, return_exceptions=True)
 
         print("\n🔍 Analysis Results:")
         print(analyzer.format_results(args.output_format))
@@ -210,9 +332,14 @@ async def main():
     finally:
         await analyzer._cleanup()
 
-async def process_batch_with_semaphore(semaphore, analyzer, batch, args):
-    async with semaphore:
-        return await analyzer.process_batch(batch, args)
+async def batch_worker(queue, analyzer, args, pbar):
+    while True:
+        batch = await queue.get()
+        try:
+            await analyzer.process_batch(batch, args)
+            pbar.update(1)
+        finally:
+            queue.task_done()
 
 if __name__ == "__main__":
     try: